@@ -32,38 +32,45 @@ import time
 from enum import IntEnum
 
 import tableprint
-from bluepy.btle import DefaultDelegate, Peripheral, Scanner, UUID
+from bluepy.btle import BTLEException, DefaultDelegate, Peripheral, Scanner, UUID
 
 # ===============================
 # Script guards for correct usage
 # ===============================
 
-if len(sys.argv) < 3:
-    print("ERROR: Missing input argument SN or SAMPLE-PERIOD.")
-    print("USAGE: read_waveplus.py SN SAMPLE-PERIOD [pipe > yourfile.txt]")
-    print("    where SN is the 10-digit serial number found under the magnetic backplate of your Wave Plus.")
-    print("    where SAMPLE-PERIOD is the time in seconds between reading the current values.")
-    print("    where [pipe > yourfile.txt] is optional and specifies that you want to pipe your results to yourfile.txt.")
+_USAGE = (
+    "USAGE: read_waveplus.py SN SAMPLE-PERIOD [pipe > yourfile.txt]\n"
+    "    where SN is the 10-digit serial number found under the magnetic backplate of your Wave Plus.\n"
+    "    where SAMPLE-PERIOD is the time in seconds between reading the current values.\n"
+    "    where [pipe > yourfile.txt] is optional and specifies that you want to pipe your results to yourfile.txt."
+)
 
-    sys.exit(1)
 
-if sys.argv[1].isdigit() is not True or len(sys.argv[1]) != 10:
-    print("ERROR: Invalid SN format.")
-    print("USAGE: read_waveplus.py SN SAMPLE-PERIOD [pipe > yourfile.txt]")
-    print("    where SN is the 10-digit serial number found under the magnetic backplate of your Wave Plus.")
-    print("    where SAMPLE-PERIOD is the time in seconds between reading the current values.")
-    print("    where [pipe > yourfile.txt] is optional and specifies that you want to pipe your results to yourfile.txt.")
+def _die(message):
+    print("ERROR: {}".format(message))
+    print(_USAGE)
 
     sys.exit(1)
 
-if sys.argv[2].isdigit() is not True or int(sys.argv[2]) < 0:
-    print("ERROR: Invalid SAMPLE-PERIOD. Must be a numerical value larger than zero.")
-    print("USAGE: read_waveplus.py SN SAMPLE-PERIOD [pipe > yourfile.txt]")
-    print("    where SN is the 10-digit serial number found under the magnetic backplate of your Wave Plus.")
-    print("    where SAMPLE-PERIOD is the time in seconds between reading the current values.")
-    print("    where [pipe > yourfile.txt] is optional and specifies that you want to pipe your results to yourfile.txt.")
 
-    sys.exit(1)
+if len(sys.argv) < 3:
+    _die("Missing input argument SN or SAMPLE-PERIOD.")
+
+try:
+    SERIAL_NUMBER = int(sys.argv[1])
+except ValueError:
+    _die("Invalid SN format.")
+
+if SERIAL_NUMBER < 0 or len(sys.argv[1]) != 10:
+    _die("Invalid SN format.")
+
+try:
+    SAMPLE_PERIOD = int(sys.argv[2])
+except ValueError:
+    _die("Invalid SAMPLE-PERIOD. Must be a numerical value larger than zero.")
+
+if SAMPLE_PERIOD < 0:
+    _die("Invalid SAMPLE-PERIOD. Must be a numerical value larger than zero.")
 
 if len(sys.argv) > 3:
     MODE = sys.argv[3].lower()
@@ -71,67 +78,79 @@ else:
     MODE = 'terminal'  # (default) print to terminal
 
 if MODE != 'pipe' and MODE != 'terminal':
-    print("ERROR: Invalid piping method.")
-    print("USAGE: read_waveplus.py SN SAMPLE-PERIOD [pipe > yourfile.txt]")
-    print("    where SN is the 10-digit serial number found under the magnetic backplate of your Wave Plus.")
-    print("    where SAMPLE-PERIOD is the time in seconds between reading the current values.")
-    print("    where [pipe > yourfile.txt] is optional and specifies that you want to pipe your results to yourfile.txt.")
-
-    sys.exit(1)
-
-SERIAL_NUMBER = int(sys.argv[1])
-SAMPLE_PERIOD = int(sys.argv[2])
+    _die("Invalid piping method.")
 
 
 # ====================================
 # Utility functions for WavePlus class
 # ====================================
 
+# Precompiled once so the format string is not reparsed on every sample.
+# Pad bytes skip the unused fields of the 20-byte record, so unpacking yields
+# only (version, humidity, radon ST, radon LT, temperature, pressure, CO2, VOC)
+_RAW_STRUCT = struct.Struct('<BB2xHHHHHH4x')
+
+
 def parse_serial_number(manu_data_hex_str):
     if manu_data_hex_str is None or manu_data_hex_str == 'None':
         return 'Unknown'
 
-    manu_data = bytearray.fromhex(manu_data_hex_str)
-    if not (((manu_data[1] << 8) | manu_data[0]) == 0x0334):
+    # Cheap prefix test ('3403' is the 0x0334 manufacturer ID little-endian)
+    # rejects foreign advertisements without decoding any bytes; this runs
+    # once per received advertisement while scanning
+    if len(manu_data_hex_str) < 12 or not manu_data_hex_str.startswith('3403'):
         return 'Unknown'
 
-    SN = manu_data[2]
-    SN |= (manu_data[3] << 8)
-    SN |= (manu_data[4] << 16)
-    SN |= (manu_data[5] << 24)
-
-    return SN
+    return int.from_bytes(bytes.fromhex(manu_data_hex_str[4:12]), 'little')
 
 
 # ===============================
 # Class WavePlus
 # ===============================
 
+class _FindDelegate(DefaultDelegate):
+    # Matches advertisements against the target serial number as they arrive,
+    # so scanning can stop as soon as the device is seen
+
+    def __init__(self, serial_number):
+        DefaultDelegate.__init__(self)
+        self.serial_number = serial_number
+        self.found_addr = None
+
+    def handleDiscovery(self, dev, isNewDev, isNewData):
+        manu_data = dev.getValueText(255)
+
+        if parse_serial_number(manu_data) == self.serial_number:
+            self.found_addr = dev.addr
+
+
 class WavePlus:
     def __init__(self, serial_number):
         self.peripheral = None
-        self.curr_val_char = None
         self.mac_address = None
+        self._handle = None  # current-values characteristic handle, stable per device
         self.serial_number = serial_number
         self.uuid = UUID('b42e2a68-ade7-11e4-89d3-123b93f75cba')
+        self.sensors = Sensors()  # reused across reads to avoid per-sample allocation
+        self._parser = None  # bound per-version setter, resolved on first read
 
     def connect(self):
         # Auto-discover device on first connection
         if self.mac_address is None:
-            scanner = Scanner().withDelegate(DefaultDelegate())
-            searchCount = 0
+            delegate = _FindDelegate(self.serial_number)
+            scanner = Scanner().withDelegate(delegate)
 
-            while self.mac_address is None and searchCount < 50:
-                devices = scanner.scan(0.1)  # 0.1 seconds scan period
-                searchCount += 1
+            # Single event-driven scan instead of restarting short polled scans
+            scanner.start()
+            try:
+                deadline = time.monotonic() + 5.0  # seconds scan timeout
 
-                for dev in devices:
-                    manu_data = dev.getValueText(255)
-                    serial_number = parse_serial_number(manu_data)
+                while delegate.found_addr is None and time.monotonic() < deadline:
+                    scanner.process(1.0)
+            finally:
+                scanner.stop()
 
-                    if serial_number == self.serial_number:
-                        self.mac_address = dev.addr  # exits the while loop on next conditional check
-                        break  # exit for loop
+            self.mac_address = delegate.found_addr
 
             if self.mac_address is None:
                 print("ERROR: Could not find device.")
@@ -145,21 +164,28 @@ class WavePlus:
         if self.peripheral is None:
             self.peripheral = Peripheral(self.mac_address)
 
-        if self.curr_val_char is None:
-            self.curr_val_char = self.peripheral.getCharacteristics(uuid=self.uuid)[0]
+        # Characteristic discovery costs a GATT round-trip; the handle is
+        # stable for a given device, so look it up once and reuse it on
+        # later reconnects
+        if self._handle is None:
+            self._handle = self.peripheral.getCharacteristics(uuid=self.uuid)[0].getHandle()
 
     def read(self):
-        if self.curr_val_char is None:
+        if self.peripheral is None or self._handle is None:
             print('ERROR: Devices are not connected.')
             sys.exit(1)
 
-        rawdata = self.curr_val_char.read()
-        rawdata = struct.unpack('<BBBBHHHHHHHH', rawdata)
+        rawdata = self.peripheral.readCharacteristic(self._handle)
+        rawdata = _RAW_STRUCT.unpack(rawdata)
+
+        # The firmware version is stable for a given device, so the version
+        # branch only runs once; later samples call the chosen setter directly
+        if self._parser is None:
+            self._parser = _parser_for_version(self.sensors, rawdata[0])
 
-        sensors = Sensors()
-        sensors.set(rawdata)
+        self._parser(rawdata)
 
-        return sensors
+        return self.sensors
 
     def disconnect(self):
         if self.peripheral is None:
@@ -167,7 +193,6 @@ class WavePlus:
 
         self.peripheral.disconnect()
         self.peripheral = None
-        self.curr_val_char = None
 
 
 # ===================================
@@ -184,7 +209,9 @@ class SensorIndex(IntEnum):
     VOC_LVL = 6
 
 
-SENSOR_UNITS = [
+# Tuples rather than lists: immutable, and cheap to freeze into local
+# default arguments below instead of global lookups on every sample
+SENSOR_UNITS = (
     '%rH',
     'Bq/m3',
     'Bq/m3',
@@ -192,9 +219,9 @@ SENSOR_UNITS = [
     'hPa',
     'ppm',
     'ppb',
-]
+)
 
-SENSOR_HEADERS = [
+SENSOR_HEADERS = (
     'Humidity',
     'Radon ST avg',
     'Radon LT avg',
@@ -202,7 +229,19 @@ SENSOR_HEADERS = [
     'Pressure',
     'CO2 level',
     'VOC level',
-]
+)
+
+
+# Prebuilt row template matching tableprint's layout (7 columns, width 12);
+# avoids rebuilding tableprint's formatting state on every sample
+_ROW_FMT = '│ ' + ' │ '.join(['{:>12}'] * len(SENSOR_HEADERS)) + ' │\n'
+
+
+def _conv2radon(radon_raw):
+    if 0 <= radon_raw <= 16383:
+        return radon_raw
+
+    return 'N/A'  # Either invalid measurement, or not available
 
 
 class Sensors:
@@ -210,35 +249,75 @@ class Sensors:
         self.sensor_version = None
         self.sensor_data = [None] * len(SENSOR_UNITS)
 
-    def set(self, rawData):
-        self.sensor_version = rawData[0]
-        if self.sensor_version == 1:
-            self.sensor_data[SensorIndex.HUMIDITY] = rawData[1] / 2.0
-            self.sensor_data[SensorIndex.RADON_SHORT_TERM_AVG] = self.conv2radon(rawData[4])
-            self.sensor_data[SensorIndex.RADON_LONG_TERM_AVG] = self.conv2radon(rawData[5])
-            self.sensor_data[SensorIndex.TEMPERATURE] = rawData[6] / 100.0
-            self.sensor_data[SensorIndex.REL_ATM_PRESSURE] = rawData[7] / 50.0
-            self.sensor_data[SensorIndex.CO2_LVL] = rawData[8]
-            self.sensor_data[SensorIndex.VOC_LVL] = rawData[9]
-        else:
-            print('ERROR: Unknown sensor version.\n')
-            print('GUIDE: Contact Airthings for support.\n')
-            sys.exit(1)
-
-    def conv2radon(self, radon_raw):
-        if 0 <= radon_raw <= 16383:
-            return radon_raw
-
-        return 'N/A'  # Either invalid measurement, or not available
+    def set_v1(self, rawData):
+        # One fused conversion pass; rawData follows the _RAW_STRUCT layout
+        self.sensor_version = 1
+        self.sensor_data = [
+            rawData[1] / 2.0,  # humidity
+            _conv2radon(rawData[2]),
+            _conv2radon(rawData[3]),
+            rawData[4] / 100.0,  # temperature
+            rawData[5] / 50.0,  # pressure
+            rawData[6],  # CO2
+            rawData[7],  # VOC
+        ]
 
     def get_value(self, sensor_index):
         return self.sensor_data[sensor_index]
 
-    def get_unit(self, sensor_index):
-        return SENSOR_UNITS[sensor_index]
+    def get_unit(self, sensor_index, _units=SENSOR_UNITS):
+        return _units[sensor_index]
+
+    def render(self):
+        # Unrolled on purpose: skips the zip iterator and per-pair unpacking
+        # of the former __iter__ protocol (units mirror SENSOR_UNITS)
+        d = self.sensor_data
+
+        return [
+            f'{d[0]} %rH',
+            f'{d[1]} Bq/m3',
+            f'{d[2]} Bq/m3',
+            f'{d[3]} °C',
+            f'{d[4]} hPa',
+            f'{d[5]} ppm',
+            f'{d[6]} ppb',
+        ]
+
+
+def _parser_for_version(sensors, sensor_version):
+    if sensor_version == 1:
+        return sensors.set_v1
+
+    print('ERROR: Unknown sensor version.\n')
+    print('GUIDE: Contact Airthings for support.\n')
+    sys.exit(1)
+
+
+def _write_table_header(headers):
+    print(tableprint.header(headers, width=12))
 
-    def __iter__(self):
-        return zip(self.sensor_data, SENSOR_UNITS)
+
+def _write_table_row(data):
+    sys.stdout.write(_ROW_FMT.format(*data))
+
+
+def _write_csv_header(headers):
+    sys.stdout.write(','.join(headers))
+    sys.stdout.write('\n')
+
+
+def _write_csv_row(data):
+    # Machine-parseable, unlike printing the list repr
+    sys.stdout.write(','.join(data))
+    sys.stdout.write('\n')
+
+
+# MODE is fixed for the program's lifetime; main resolves the emitters once
+# instead of string-comparing MODE per sample
+_EMITTERS = {
+    'terminal': (_write_table_header, _write_table_row),
+    'pipe': (_write_csv_header, _write_csv_row),
+}
 
 
 def main():
@@ -250,34 +329,35 @@ def main():
 
     print('Device serial number: {}'.format(SERIAL_NUMBER))
 
+    write_header, write_row = _EMITTERS[MODE]
+
     try:
-        if MODE == 'terminal':
-            print(tableprint.header(SENSOR_HEADERS, width=12))
-        elif MODE == 'pipe':
-            print(SENSOR_HEADERS)
+        write_header(SENSOR_HEADERS)
 
-        while True:
-            waveplus.connect()
+        # Stay connected between samples; a reconnect repeats the full GATT
+        # discovery handshake and dominates the per-sample latency
+        waveplus.connect()
 
-            # read values
-            sensors = waveplus.read()
+        # Schedule against a fixed monotonic grid so the cadence does not
+        # slip by the BLE read time every tick
+        next_tick = time.monotonic()
 
-            # extract
-            data = [
-                '{} {}'.format(data, unit)
-                for data, unit in sensors
-            ]
+        while True:
+            # read values, reconnecting once on a dropped link
+            try:
+                sensors = waveplus.read()
+            except (BTLEException, BrokenPipeError):
+                waveplus.disconnect()
+                waveplus.connect()
+                sensors = waveplus.read()
 
-            if MODE == 'terminal':
-                print(
-                    tableprint.row(data, width=12))
-            elif MODE == 'pipe':
-                print(
-                    data)
+            # extract
+            data = sensors.render()
 
-            waveplus.disconnect()
+            write_row(data)
 
-            time.sleep(SAMPLE_PERIOD)
+            next_tick += SAMPLE_PERIOD
+            time.sleep(max(0.0, next_tick - time.monotonic()))
     finally:
         waveplus.disconnect()
 